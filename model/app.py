@@ -12,6 +12,9 @@ import numpy as np
 import logging
 import traceback
 import re
+import json
+import uuid
+import zlib
 from typing import List, Optional, Dict, Any
 from fastapi import FastAPI, File, UploadFile, Form, HTTPException, Depends, Query
 from fastapi.middleware.cors import CORSMiddleware
@@ -21,6 +24,9 @@ import shutil
 import pdfplumber
 from langchain.text_splitter import CharacterTextSplitter
 from langchain_community.vectorstores import FAISS
+from langchain_community.docstore.in_memory import InMemoryDocstore
+from langchain.docstore.document import Document
+import faiss
 from sentence_transformers import SentenceTransformer
 from langchain.embeddings.base import Embeddings
 from contextlib import asynccontextmanager
@@ -29,26 +35,36 @@ from contextlib import asynccontextmanager
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
-app = FastAPI(title="Indian Legal Document Analysis API")
-
-app.add_middleware(
-    CORSMiddleware,
-    allow_origins=["http://localhost:3000"],  # Allow all origins for testing - restrict in production
-    allow_credentials=True,
-    allow_methods=["*"],
-    allow_headers=["*"],
-)
-
 # Constants
 VECTOR_DB_DIR = "vector_db"
+STORAGE_REPORT_FILE = "storage_report.json"  # saved next to the index in VECTOR_DB_DIR
 CHUNK_SIZE = 1000
 CHUNK_OVERLAP = 200
 MODEL_SIZE = os.environ.get("INSTRUCTOR_MODEL_SIZE", "base")  # base, large, or xl
 MODEL_NAME = f"hkunlp/instructor-{MODEL_SIZE}"
+EMBEDDING_STORAGE = os.environ.get("EMBEDDING_STORAGE", "float32")  # float32, float16, or sq8
+EMBEDDING_PCA_DIM = os.environ.get("EMBEDDING_PCA_DIM", "0")  # 0 keeps the full model dimension
+STORAGE_REPORT_K = 10
+STORAGE_REPORT_QUERIES = 100
+DEDUP_THRESHOLD = os.environ.get("DEDUP_THRESHOLD", "0.85")  # Jaccard similarity in (0, 1]; 1.0 disables
+SHINGLE_SIZE = 5  # words per shingle
+MINHASH_PERMUTATIONS = 128
+MINHASH_BANDS = 16  # LSH bands; rows per band = MINHASH_PERMUTATIONS // MINHASH_BANDS
+MINHASH_PRIME = (1 << 31) - 1
+ENCODE_BATCH_SIZE = os.environ.get("ENCODE_BATCH_SIZE", "32")
+ENCODE_BUCKET_BATCHES = 16  # batches per length-sorted bucket
+ENCODE_THREADS = os.environ.get("ENCODE_THREADS", "0")  # 0 keeps the torch/FAISS default
+ENCODE_CPU_AFFINITY = os.environ.get("ENCODE_CPU_AFFINITY", "")  # e.g. "0-3,6"; pins the whole process, empty disables
+INDEX_TRAIN_SIZE = 1024  # chunks sampled across the upload to train and evaluate the index
+# Numeric settings above are read as strings and converted by validate_settings() at import
+
+# Bytes stored per vector dimension for each storage option
+EMBEDDING_STORAGE_BYTES = {"float32": 4, "float16": 2, "sq8": 1}
 
 # Global variables
 vector_store = None
 instructor_model = None
+embedding_storage_report = None
 
 # Base models for API responses
 class SearchQuery(BaseModel):
@@ -157,10 +173,40 @@ class CustomInstructorEmbeddings(Embeddings):
         self.embed_instruction = "Represent the Indian legal document for retrieval:"
         self.query_instruction = "Represent the Indian legal query for retrieval:"
         
-    def embed_documents(self, texts):
+    def embed_documents_array(self, texts, batch_size=None):
+        """Embed documents as a float32 NumPy array of shape (len(texts), dim)."""
+        batch_size = batch_size or ENCODE_BATCH_SIZE
         instructions = [[self.embed_instruction, text] for text in texts]
-        embeddings = self.model.encode(instructions)
-        return embeddings.tolist()
+        embeddings = self.model.encode(instructions, batch_size=batch_size, convert_to_numpy=True, show_progress_bar=False)
+        return np.ascontiguousarray(embeddings, dtype=np.float32)
+
+    def iter_document_batches(self, texts, ids=None, batch_size=None):
+        """
+        Yield (ids, embeddings) batches for texts (or the given ids), sorted by length
+        within buckets so each batch holds chunks of similar length and wastes little padding.
+        """
+        batch_size = batch_size or ENCODE_BATCH_SIZE
+        ids = list(range(len(texts)) if ids is None else ids)
+        bucket_size = batch_size * ENCODE_BUCKET_BATCHES
+        encoded = 0
+        for bucket_start in range(0, len(ids), bucket_size):
+            bucket_ids = sorted(ids[bucket_start:bucket_start + bucket_size], key=lambda i: len(texts[i]), reverse=True)
+            for batch_start in range(0, len(bucket_ids), batch_size):
+                batch_ids = bucket_ids[batch_start:batch_start + batch_size]
+                embeddings = self.embed_documents_array([texts[i] for i in batch_ids], batch_size=batch_size)
+                encoded += len(batch_ids)
+                logger.info(f"Encoded {encoded}/{len(ids)} chunks")
+                yield batch_ids, embeddings
+
+    def embed_documents(self, texts):
+        return self.embed_documents_array(texts).tolist()
+
+    def embed_queries_array(self, texts, batch_size=None):
+        """Embed queries as a float32 NumPy array of shape (len(texts), dim)."""
+        batch_size = batch_size or ENCODE_BATCH_SIZE
+        instructions = [[self.query_instruction, text] for text in texts]
+        embeddings = self.model.encode(instructions, batch_size=batch_size, convert_to_numpy=True, show_progress_bar=False)
+        return np.ascontiguousarray(embeddings, dtype=np.float32)
     
     def embed_query(self, text):
         instruction = [[self.query_instruction, text]]
@@ -169,6 +215,79 @@ class CustomInstructorEmbeddings(Embeddings):
         logger.debug(f"Query embedding length: {len(flat_embedding)}")
         return flat_embedding
 
+def parse_cpu_list(cpu_list):
+    """Parse a CPU list such as "0-3,6" into a set of core ids."""
+    cores = set()
+    for part in cpu_list.split(","):
+        part = part.strip()
+        if not part:
+            continue
+        if "-" in part:
+            start, end = map(int, part.split("-"))
+            if start > end:
+                raise ValueError(f"Reversed CPU range: {part}")
+            cores.update(range(start, end + 1))
+        else:
+            cores.add(int(part))
+    if not cores:
+        raise ValueError("Empty CPU list")
+    return cores
+
+def parse_setting(name, value, convert):
+    """Convert a raw environment setting, failing clearly if it is malformed."""
+    try:
+        return convert(value)
+    except ValueError:
+        raise RuntimeError(f"Invalid {name}: {value!r} (expected {convert.__name__})")
+
+def validate_settings():
+    """Parse and check the embedding storage and encoding settings, failing clearly at startup."""
+    global EMBEDDING_PCA_DIM, DEDUP_THRESHOLD, ENCODE_BATCH_SIZE, ENCODE_THREADS
+    EMBEDDING_PCA_DIM = parse_setting("EMBEDDING_PCA_DIM", EMBEDDING_PCA_DIM, int)
+    DEDUP_THRESHOLD = parse_setting("DEDUP_THRESHOLD", DEDUP_THRESHOLD, float)
+    ENCODE_BATCH_SIZE = parse_setting("ENCODE_BATCH_SIZE", ENCODE_BATCH_SIZE, int)
+    ENCODE_THREADS = parse_setting("ENCODE_THREADS", ENCODE_THREADS, int)
+
+    if EMBEDDING_STORAGE not in EMBEDDING_STORAGE_BYTES:
+        raise RuntimeError(f"Unsupported EMBEDDING_STORAGE: {EMBEDDING_STORAGE} (expected one of {', '.join(EMBEDDING_STORAGE_BYTES)})")
+    if EMBEDDING_PCA_DIM < 0:
+        raise RuntimeError(f"EMBEDDING_PCA_DIM must be 0 or positive, got {EMBEDDING_PCA_DIM}")
+    if not 0 < DEDUP_THRESHOLD <= 1:
+        raise RuntimeError(f"DEDUP_THRESHOLD must be in (0, 1], got {DEDUP_THRESHOLD}")
+    if ENCODE_BATCH_SIZE < 1:
+        raise RuntimeError(f"ENCODE_BATCH_SIZE must be positive, got {ENCODE_BATCH_SIZE}")
+    if ENCODE_THREADS < 0:
+        raise RuntimeError(f"ENCODE_THREADS must be 0 or positive, got {ENCODE_THREADS}")
+
+    if not ENCODE_CPU_AFFINITY:
+        return None
+    if not hasattr(os, "sched_setaffinity"):
+        raise RuntimeError("ENCODE_CPU_AFFINITY is set but CPU affinity is not supported on this platform")
+    try:
+        cores = parse_cpu_list(ENCODE_CPU_AFFINITY)
+    except ValueError:
+        raise RuntimeError(f"Invalid ENCODE_CPU_AFFINITY: {ENCODE_CPU_AFFINITY!r} (expected a CPU list such as \"0-3,6\")")
+    unavailable = cores - os.sched_getaffinity(0)
+    if unavailable:
+        raise RuntimeError(f"ENCODE_CPU_AFFINITY {ENCODE_CPU_AFFINITY!r} names unavailable CPU cores: {sorted(unavailable)}")
+    return cores
+
+def configure_encoding_threads(cores):
+    """
+    Apply the CPU affinity and thread count for encoding and indexing.
+    Affinity pins the whole server process, including the event loop, not just encoding.
+    """
+    if cores:
+        os.sched_setaffinity(0, cores)
+        logger.info(f"Pinned process to CPU cores: {sorted(cores)}")
+
+    if ENCODE_THREADS > 0:
+        torch.set_num_threads(ENCODE_THREADS)
+        faiss.omp_set_num_threads(ENCODE_THREADS)
+        logger.info(f"Using {ENCODE_THREADS} threads for encoding and indexing")
+
+configure_encoding_threads(validate_settings())
+
 def get_instructor_model():
     global instructor_model
     if instructor_model is None:
@@ -190,12 +309,23 @@ async def lifespan(app: FastAPI):
             model = get_instructor_model()
             vector_store = FAISS.load_local(VECTOR_DB_DIR, model, allow_dangerous_deserialization=True)
             logger.info("Vector store loaded from disk")
+            load_embedding_storage_report()
     except Exception as e:
         logger.error(f"Could not load vector store: {str(e)}")
         logger.error(traceback.format_exc())
 
     yield  # App runs here
 
+app = FastAPI(title="Indian Legal Document Analysis API", lifespan=lifespan)
+
+app.add_middleware(
+    CORSMiddleware,
+    allow_origins=["http://localhost:3000"],  # Allow all origins for testing - restrict in production
+    allow_credentials=True,
+    allow_methods=["*"],
+    allow_headers=["*"],
+)
+
 def extract_named_entities(text):
     """
     Enhanced regex-based extraction of potential named entities in legal documents.
@@ -415,20 +545,22 @@ async def upload_documents(files: List[UploadFile] = File(...)):
                 file_paths.append(file_path)
             
             try:
-                raw_text = get_pdf_text(file_paths)
-                logger.info(f"Successfully extracted text from PDFs: {len(raw_text)} characters")
+                file_texts = get_pdf_texts(file_paths)
+                logger.info(f"Successfully extracted text from PDFs: {sum(len(text) for text in file_texts)} characters")
                 
-                # Perform legal analysis on the raw text
+                # Perform legal analysis on each file's own text
                 analysis_results = []
-                for i, file_name in enumerate(file_names):
-                    analysis = analyze_legal_text(raw_text, file_name)
+                for file_name, file_text in zip(file_names, file_texts):
+                    analysis = analyze_legal_text(file_text, file_name)
                     analysis_results.append(analysis)
                 
-                text_chunks = get_text_chunks(raw_text)
+                text_chunks, chunk_refs = get_file_chunks(file_names, file_texts)
                 logger.info(f"Successfully created {len(text_chunks)} text chunks")
                 
+                unique_chunks, chunk_sources = deduplicate_chunks(text_chunks, chunk_refs)
+                
                 try:
-                    vector_store = get_text_embeddings(text_chunks)
+                    vector_store = get_text_embeddings(unique_chunks, chunk_sources)
                     logger.info("Successfully created vector store")
                     
                     return JSONResponse(
@@ -436,6 +568,8 @@ async def upload_documents(files: List[UploadFile] = File(...)):
                         content={
                             "message": "Documents processed successfully", 
                             "chunk_count": len(text_chunks),
+                            "unique_chunk_count": len(unique_chunks),
+                            "embedding_storage": embedding_storage_report,
                             "analysis": analysis_results
                         }
                     )
@@ -480,17 +614,18 @@ async def search_documents_endpoint(search_query: SearchQuery):
                 continue
             doc_id = vector_store.index_to_docstore_id[i]
             doc = vector_store.docstore.search(doc_id)
+            # Near-duplicates are merged at ingestion; metadata["sources"] lists every copy
             docs.append(doc)
 
         # Compute cosine similarities for user-facing scores
         results = []
         for doc in docs:
-            doc_emb = model.embed_documents([doc.page_content])[0]
+            doc_emb = model.embed_documents_array([doc.page_content])[0]
             sim = float(
                 np.dot(q_emb_list, doc_emb)
                 / (np.linalg.norm(q_emb_list) * np.linalg.norm(doc_emb))
             )
-            results.append(SearchResult(content=doc.page_content, similarity=sim))
+            results.append(SearchResult(content=doc.page_content, similarity=sim, metadata=doc.metadata))
 
         return SearchResponse(results=results)
 
@@ -612,19 +747,40 @@ async def get_status():
     """
     global vector_store
     
+    # Describe the index actually loaded, which may predate the current settings
+    if vector_store is not None:
+        storage, stored_dim = get_index_storage(vector_store.index)
+    else:
+        storage, stored_dim = EMBEDDING_STORAGE, EMBEDDING_PCA_DIM or None
+    
     return {
         "documents_processed": vector_store is not None,
         "ready_for_search": vector_store is not None,
         "model_loaded": instructor_model is not None,
-        "model_name": MODEL_NAME
+        "model_name": MODEL_NAME,
+        "embedding_storage": storage,
+        "embedding_dimension": stored_dim
     }
 
-def get_pdf_text(pdf_paths):
-    """Extract text from PDF files with better error handling."""
+@app.get("/embedding-storage-report/")
+async def get_embedding_storage_report():
+    """
+    Report memory saved and recall@k lost by the configured embedding storage for the last upload.
+    """
+    if embedding_storage_report is None:
+        if vector_store is not None:
+            raise HTTPException(status_code=404, detail="No storage report was saved for the loaded vector store")
+        raise HTTPException(status_code=400, detail="No documents processed yet")
+
+    return embedding_storage_report
+
+def get_pdf_texts(pdf_paths):
+    """Extract text from each PDF file with better error handling, returning one text per file."""
     logger.info(f"Processing {len(pdf_paths)} PDF files")
-    text = ""
+    texts = []
     
     for pdf_path in pdf_paths:
+        texts.append("")
         try:
             logger.info(f"Reading PDF: {os.path.basename(pdf_path)}")
             with pdfplumber.open(pdf_path) as pdf_reader:
@@ -639,17 +795,17 @@ def get_pdf_text(pdf_paths):
                         page_text = page.extract_text()
                         if not page_text:
                             logger.warning(f"Empty text extracted from page {i+1} in {os.path.basename(pdf_path)}")
-                        text += page_text or ""
+                        texts[-1] += page_text or ""
                     except Exception as e:
                         logger.error(f"Error extracting text from page {i+1} in {os.path.basename(pdf_path)}: {str(e)}")
         except Exception as e:
             logger.error(f"Error processing PDF {os.path.basename(pdf_path)}: {str(e)}")
             
-    if not text.strip():
+    if not any(text.strip() for text in texts):
         raise ValueError("No text was extracted from any of the PDF files")
         
-    logger.info(f"Successfully extracted {len(text)} characters of text from PDFs")
-    return text
+    logger.info(f"Successfully extracted {sum(len(text) for text in texts)} characters of text from PDFs")
+    return texts
 
 def get_text_chunks(text):
     """Split text into chunks with better error handling."""
@@ -677,8 +833,259 @@ def get_text_chunks(text):
         logger.error(traceback.format_exc())
         raise
 
-def get_text_embeddings(text_chunks):
+def get_file_chunks(file_names, file_texts):
+    """
+    Chunk each file separately so every chunk can be traced back to its source.
+    Returns the chunks and a {"file_name", "chunk_id"} reference for each.
+    """
+    text_chunks = []
+    chunk_refs = []
+    for file_name, file_text in zip(file_names, file_texts):
+        if not file_text.strip():
+            logger.warning(f"Skipping {file_name}: no text extracted")
+            continue
+        file_chunks = get_text_chunks(file_text)
+        text_chunks.extend(file_chunks)
+        chunk_refs.extend({"file_name": file_name, "chunk_id": i} for i in range(len(file_chunks)))
+    return text_chunks, chunk_refs
+
+def build_faiss_index(embeddings):
+    """Build and train a FAISS index for the configured storage precision and PCA dimension."""
+    dim = embeddings.shape[1]
+    stored_dim = dim
+    if EMBEDDING_PCA_DIM:
+        if EMBEDDING_PCA_DIM >= dim:
+            raise ValueError(f"EMBEDDING_PCA_DIM must be smaller than the embedding dimension ({dim})")
+        if len(embeddings) < EMBEDDING_PCA_DIM:
+            logger.warning(f"Only {len(embeddings)} chunks available to train PCA to {EMBEDDING_PCA_DIM} dimensions, keeping full dimension")
+        else:
+            stored_dim = EMBEDDING_PCA_DIM
+
+    if EMBEDDING_STORAGE == "float32":
+        index = faiss.IndexFlatL2(stored_dim)
+    else:
+        qtype = faiss.ScalarQuantizer.QT_fp16 if EMBEDDING_STORAGE == "float16" else faiss.ScalarQuantizer.QT_8bit
+        index = faiss.IndexScalarQuantizer(stored_dim, qtype, faiss.METRIC_L2)
+
+    if stored_dim != dim:
+        index = faiss.IndexPreTransform(faiss.PCAMatrix(dim, stored_dim), index)
+
+    if not index.is_trained:
+        logger.info(f"Training {EMBEDDING_STORAGE} index with {stored_dim} dimensions on {len(embeddings)} vectors")
+        index.train(embeddings)
+
+    return index
+
+def get_index_storage(index):
+    """Return the storage type and the number of dimensions stored per vector by a FAISS index."""
+    index = faiss.downcast_index(index)
+    if isinstance(index, faiss.IndexPreTransform):
+        index = faiss.downcast_index(index.index)
+
+    if isinstance(index, faiss.IndexScalarQuantizer):
+        storage = "float16" if index.sq.qtype == faiss.ScalarQuantizer.QT_fp16 else "sq8"
+    else:
+        storage = "float32"
+    return storage, index.d
+
+def get_storage_report(storage, dim, stored_dim, total_count, sample_count):
+    """Build a storage report with memory figures for total_count vectors and no recall measured yet."""
+    full_bytes = total_count * dim * EMBEDDING_STORAGE_BYTES["float32"]
+    stored_bytes = total_count * stored_dim * EMBEDDING_STORAGE_BYTES[storage]
+    return {
+        "storage": storage,
+        "vector_count": total_count,
+        "sample_count": sample_count,
+        "model_dimension": dim,
+        "stored_dimension": stored_dim,
+        "full_bytes": full_bytes,
+        "stored_bytes": stored_bytes,
+        "memory_saved_bytes": full_bytes - stored_bytes,
+        "memory_saved_ratio": 1 - stored_bytes / full_bytes,
+        "query_count": 0,
+        "k": None,
+        "recall_at_k": None,
+        "recall_lost": None
+    }
+
+def evaluate_embedding_storage(model, texts, embeddings, index, total_count=None, k=STORAGE_REPORT_K, num_queries=STORAGE_REPORT_QUERIES):
+    """
+    Measure recall@k of a trained, empty copy of the index against exact float32 search.
+    A held-out subset of the chunks is embedded with the query instruction and kept out of
+    both indexes, so no query can match its own stored vector. Recall is measured on the
+    sample index, not the full upload; memory figures are scaled to total_count vectors.
+    """
+    count, dim = embeddings.shape
+    storage, stored_dim = get_index_storage(index)
+    report = get_storage_report(storage, dim, stored_dim, total_count or count, count)
+
+    num_queries = min(num_queries, count // 2)
+    if num_queries == 0:
+        logger.warning(f"Only {count} chunks available, skipping recall measurement")
+        return report
+
+    rng = np.random.default_rng(0)
+    query_ids = rng.choice(count, size=num_queries, replace=False)
+    corpus_mask = np.ones(count, dtype=bool)
+    corpus_mask[query_ids] = False
+    corpus = embeddings[corpus_mask]
+    k = min(k, len(corpus))
+
+    exact_index = faiss.IndexFlatL2(dim)
+    exact_index.add(corpus)
+    index.add(corpus)
+
+    queries = model.embed_queries_array([texts[i] for i in query_ids])
+    _, exact_ids = exact_index.search(queries, k)
+    _, stored_ids = index.search(queries, k)
+
+    recall = float(np.mean([
+        len(set(exact_row) & set(stored_row)) / k
+        for exact_row, stored_row in zip(exact_ids, stored_ids)
+    ]))
+
+    report.update({
+        "query_count": int(num_queries),
+        "k": k,
+        "recall_at_k": recall,
+        "recall_lost": 1 - recall
+    })
+    return report
+
+def save_embedding_storage_report():
+    """Save the storage report next to the index so it survives restarts."""
+    with open(os.path.join(VECTOR_DB_DIR, STORAGE_REPORT_FILE), "w") as report_file:
+        json.dump(embedding_storage_report, report_file)
+
+def load_embedding_storage_report():
+    """Load the storage report saved with the index, if there is one."""
+    global embedding_storage_report
+    report_path = os.path.join(VECTOR_DB_DIR, STORAGE_REPORT_FILE)
+    if os.path.exists(report_path):
+        with open(report_path) as report_file:
+            embedding_storage_report = json.load(report_file)
+    else:
+        embedding_storage_report = None
+        logger.warning("No storage report found for the loaded vector store")
+
+def add_embeddings_to_store(vector_store, texts, embeddings, metadatas):
+    """Add precomputed NumPy embeddings and their documents to a FAISS vector store."""
+    doc_ids = [str(uuid.uuid4()) for _ in texts]
+    start = vector_store.index.ntotal
+
+    vector_store.index.add(embeddings)
+    vector_store.docstore.add({
+        doc_id: Document(page_content=text, metadata=metadata)
+        for doc_id, text, metadata in zip(doc_ids, texts, metadatas)
+    })
+    vector_store.index_to_docstore_id.update({start + i: doc_id for i, doc_id in enumerate(doc_ids)})
+
+def get_sample_ids(count, sample_size=INDEX_TRAIN_SIZE):
+    """Pick up to sample_size chunk ids evenly strided across the whole upload."""
+    return np.unique(np.linspace(0, count - 1, num=min(count, sample_size)).astype(int)).tolist()
+
+def new_vector_store(model, index):
+    """Wrap an empty FAISS index in a vector store with an in-memory docstore."""
+    return FAISS(
+        embedding_function=model,
+        index=index,
+        docstore=InMemoryDocstore(),
+        index_to_docstore_id={}
+    )
+
+def create_vector_store(model, text_chunks, chunk_metadata, batches):
+    """Train the index on the sampled batches, evaluate its storage and add the batches to a new store."""
+    sample = np.concatenate([embeddings for _, embeddings in batches])
+    sample_texts = [text_chunks[i] for batch_ids, _ in batches for i in batch_ids]
+    index = build_faiss_index(sample)
+    # clone_index returns an owning wrapper of the concrete subclass; keep it alive for the evaluation
+    eval_index = faiss.clone_index(index)
+    report = evaluate_embedding_storage(model, sample_texts, sample, eval_index, total_count=len(text_chunks))
+
+    vector_store = new_vector_store(model, index)
+    for batch_ids, embeddings in batches:
+        add_embedding_batch(vector_store, text_chunks, chunk_metadata, batch_ids, embeddings)
+
+    return vector_store, report
+
+def add_embedding_batch(vector_store, text_chunks, chunk_metadata, batch_ids, embeddings):
+    """Add one encoded batch of chunks to the vector store."""
+    add_embeddings_to_store(
+        vector_store,
+        [text_chunks[i] for i in batch_ids],
+        embeddings,
+        [chunk_metadata[i] for i in batch_ids]
+    )
+
+def get_chunk_shingles(chunk):
+    """Hash the overlapping word shingles of a chunk into an array of 32-bit values."""
+    words = re.findall(r"\w+", chunk.lower())
+    if len(words) <= SHINGLE_SIZE:
+        shingles = {" ".join(words)}
+    else:
+        shingles = {" ".join(words[i:i + SHINGLE_SIZE]) for i in range(len(words) - SHINGLE_SIZE + 1)}
+    return np.array([zlib.crc32(shingle.encode("utf-8")) for shingle in shingles], dtype=np.uint64)
+
+def compute_minhash_signature(shingles, hash_a, hash_b):
+    """Compute the MinHash signature of a shingle set using universal hashing."""
+    prime = np.uint64(MINHASH_PRIME)
+    hashes = (np.outer(shingles % prime, hash_a) + hash_b) % prime
+    return hashes.min(axis=0)
+
+def deduplicate_chunks(text_chunks, chunk_refs=None):
+    """
+    Collapse near-duplicate chunks using MinHash signatures and LSH banding.
+    Returns the unique chunks and, for each, the references of all original chunks it stands for.
+    """
+    if chunk_refs is None:
+        chunk_refs = [{"file_name": None, "chunk_id": i} for i in range(len(text_chunks))]
+    if DEDUP_THRESHOLD >= 1.0:
+        return list(text_chunks), [[ref] for ref in chunk_refs]
+
+    rng = np.random.default_rng(0)
+    hash_a = rng.integers(1, MINHASH_PRIME, size=MINHASH_PERMUTATIONS, dtype=np.uint64)
+    hash_b = rng.integers(0, MINHASH_PRIME, size=MINHASH_PERMUTATIONS, dtype=np.uint64)
+    rows = MINHASH_PERMUTATIONS // MINHASH_BANDS
+
+    buckets = [{} for _ in range(MINHASH_BANDS)]
+    signatures = []
+    unique_chunks = []
+    chunk_sources = []
+
+    for chunk_id, chunk in enumerate(text_chunks):
+        signature = compute_minhash_signature(get_chunk_shingles(chunk), hash_a, hash_b)
+        band_keys = [signature[band * rows:(band + 1) * rows].tobytes() for band in range(MINHASH_BANDS)]
+
+        candidates = set()
+        for band, key in enumerate(band_keys):
+            candidates.update(buckets[band].get(key, ()))
+
+        # Verify LSH candidates with the estimated Jaccard similarity
+        match = None
+        best_similarity = DEDUP_THRESHOLD
+        for candidate in candidates:
+            similarity = float(np.mean(signatures[candidate] == signature))
+            if similarity >= best_similarity:
+                match, best_similarity = candidate, similarity
+
+        if match is not None:
+            chunk_sources[match].append(chunk_refs[chunk_id])
+            continue
+
+        unique_id = len(unique_chunks)
+        signatures.append(signature)
+        unique_chunks.append(chunk)
+        chunk_sources.append([chunk_refs[chunk_id]])
+        for band, key in enumerate(band_keys):
+            buckets[band].setdefault(key, []).append(unique_id)
+
+    logger.info(f"Deduplicated {len(text_chunks)} chunks to {len(unique_chunks)} unique chunks")
+    return unique_chunks, chunk_sources
+
+def get_text_embeddings(text_chunks, chunk_sources=None):
     """Create embeddings and vector store using the INSTRUCTOR model."""
+    global embedding_storage_report
+
     if not text_chunks:
         raise ValueError("No text chunks provided for embedding")
         
@@ -688,17 +1095,45 @@ def get_text_embeddings(text_chunks):
         model = get_instructor_model()
         
         # Create vector store with document metadata
-        chunk_metadata = [{"chunk_id": i, "chunk_size": len(chunk)} for i, chunk in enumerate(text_chunks)]
+        if chunk_sources is None:
+            chunk_sources = [[{"file_name": None, "chunk_id": i}] for i in range(len(text_chunks))]
+        chunk_metadata = [
+            {"chunk_id": i, "chunk_size": len(chunk), "sources": sources}
+            for i, (chunk, sources) in enumerate(zip(text_chunks, chunk_sources))
+        ]
+        
+        vector_store = None
+        if EMBEDDING_STORAGE == "float32" and not EMBEDDING_PCA_DIM:
+            # A flat float32 index needs no training and matches exact search, so nothing is sampled
+            stream_ids = range(len(text_chunks))
+        else:
+            # Train and evaluate the index on chunks strided across the whole upload, then stream the rest
+            sample_ids = get_sample_ids(len(text_chunks))
+            sample_batches = list(model.iter_document_batches(text_chunks, sample_ids))
+            vector_store, embedding_storage_report = create_vector_store(model, text_chunks, chunk_metadata, sample_batches)
+            del sample_batches
+            sampled = set(sample_ids)
+            stream_ids = [i for i in range(len(text_chunks)) if i not in sampled]
+        
+        # Stream batches into the index as they are encoded so peak memory stays bounded
+        for batch_ids, embeddings in model.iter_document_batches(text_chunks, stream_ids):
+            if vector_store is None:
+                dim = embeddings.shape[1]
+                vector_store = new_vector_store(model, faiss.IndexFlatL2(dim))
+                embedding_storage_report = get_storage_report("float32", dim, dim, len(text_chunks), 0)
+                embedding_storage_report.update({"recall_at_k": 1.0, "recall_lost": 0.0})
+            add_embedding_batch(vector_store, text_chunks, chunk_metadata, batch_ids, embeddings)
         
-        vector_store = FAISS.from_texts(
-            texts=text_chunks,
-            embedding=model,
-            metadatas=chunk_metadata
+        logger.info(
+            f"Embedding storage {embedding_storage_report['storage']} ({embedding_storage_report['stored_dimension']} dims): "
+            f"saved {embedding_storage_report['memory_saved_bytes']} bytes, "
+            f"recall@{embedding_storage_report['k']} = {embedding_storage_report['recall_at_k']}"
         )
         
         # Save to disk to persist across restarts
         logger.info("Saving vector store to disk")
         vector_store.save_local(VECTOR_DB_DIR)
+        save_embedding_storage_report()
         
         logger.info(f"Successfully created vector store")
         return vector_store